@@ -2,6 +2,8 @@
 
 import sys
 import os
+import time
+from collections import deque
 from datetime import datetime
 import platform
 from PySide6.QtWidgets import (
@@ -12,7 +14,10 @@ from PySide6.QtGui import QIcon, QAction, QColor, QPalette
 from PySide6.QtCore import QThread, Signal, QTimer, Qt, Slot
 from PySide6.QtSvgWidgets import QSvgWidget
 from qt_material import apply_stylesheet
-from ssh_manager import PassWallManager
+from ssh_manager import PassWallManager, DEFAULT_SNAPSHOT_FILES
+from snapshot_store import SnapshotStore
+from rules_engine import RulesEngine
+from session_trace import TraceRecorder, ReplayManager
 from config import Config
 
 # Ensure working directory is the folder containing the executable or script
@@ -178,22 +183,31 @@ class StatusWorker(QThread):
     """
     status_updated = Signal(str)
     ip_updated = Signal(str)
+    latency_updated = Signal(float)
     log_message = Signal(str)
     refresh_ip_requested = Signal()
 
-    def __init__(self, manager):
+    def __init__(self, manager, snapshot_store=None):
         super().__init__()
         self.manager = manager
+        self.snapshot_store = snapshot_store
+        self.snapshot_files = DEFAULT_SNAPSHOT_FILES
+        self.pending_requests = deque()  # Long-running jobs handed over from the GUI thread
         self.running = True
         self.poll_interval = 5  # Default, can be overridden
         self.ip_check_counter = 0
         self.ip_check_interval = 12  # Check IP every 12 status checks (60 seconds if status check is 5 seconds)
+        self.check_count = 0
+        self.check_overhead = 0.0  # Seconds spent in checks excluding replayed network delays
 
     @Slot()
     def check_status(self):
         """Perform a single status check and emit the result."""
+        check_started, slept_before = time.monotonic(), self._replay_sleep_time()
         self.log_message.emit("INFO: Initiating status check - connecting to OpenWrt router via SSH...")
+        started = time.monotonic()
         status = self.manager.get_status()
+        latency_ms = (time.monotonic() - started) * 1000
         
         if status == "error":
             self.log_message.emit("ERROR: Failed to retrieve Pass Wall service status from router")
@@ -204,11 +218,15 @@ class StatusWorker(QThread):
         else:
             self.log_message.emit(f"INFO: Pass Wall service status check completed - status: {status.upper()}")
             
+        if status != "error":
+            self.latency_updated.emit(latency_ms)
+        self._add_check_overhead(check_started, slept_before)
         self.status_updated.emit(status)
 
     @Slot()
     def check_ip(self):
         """Perform a single IP check and emit the result."""
+        check_started, slept_before = time.monotonic(), self._replay_sleep_time()
         self.log_message.emit("INFO: Initiating IP address check - using current device network interface via HTTP requests...")
         ip = self.manager.get_current_ip()
         
@@ -217,8 +235,19 @@ class StatusWorker(QThread):
         else:
             self.log_message.emit(f"SUCCESS: IP address check completed - current IP: {ip}")
             
+        self._add_check_overhead(check_started, slept_before)
         self.ip_updated.emit(ip)
 
+    def _replay_sleep_time(self):
+        """Seconds this thread has spent in replayed network delays (0 outside replay)."""
+        if isinstance(self.manager, ReplayManager):
+            return self.manager.thread_sleep_time()
+        return 0.0
+
+    def _add_check_overhead(self, started, slept_before):
+        self.check_count += 1
+        self.check_overhead += (time.monotonic() - started) - (self._replay_sleep_time() - slept_before)
+
     @Slot(str)
     def request_toggle(self, current_status):
         """Toggle the service in the background and then check status."""
@@ -236,6 +265,65 @@ class StatusWorker(QThread):
         self.log_message.emit("INFO: Verifying service state change by performing status check...")
         self.check_status()
 
+    @Slot()
+    def request_snapshot(self):
+        """Queue a configuration snapshot to run on the worker thread."""
+        self.log_message.emit("INFO: Configuration snapshot queued")
+        self.pending_requests.append(self.take_snapshot)
+
+    @Slot()
+    def request_restore(self):
+        """Queue a restore of the latest snapshot to run on the worker thread."""
+        self.log_message.emit("INFO: Configuration restore queued")
+        self.pending_requests.append(self.restore_latest_snapshot)
+
+    def _run_pending_requests(self):
+        """Run jobs queued by the request_* slots. Called from the worker thread only."""
+        while self.pending_requests and self.running:
+            self.pending_requests.popleft()()
+
+    def take_snapshot(self):
+        """Snapshot the router's Pass Wall configuration and log what changed since the previous one."""
+        self.log_message.emit("INFO: Fetching Pass Wall configuration files from router for snapshot...")
+        try:
+            previous_id = self.snapshot_store.latest_snapshot()
+        except Exception as e:
+            self.log_message.emit(f"WARNING: Could not read existing snapshots, skipping diff: {e}")
+            previous_id = None
+        snapshot_id = self.manager.snapshot_config(self.snapshot_store, paths=self.snapshot_files)
+        if snapshot_id == "error":
+            self.log_message.emit("ERROR: Failed to snapshot Pass Wall configuration from router")
+            return
+        self.log_message.emit(f"SUCCESS: Configuration snapshot {snapshot_id} saved")
+        if previous_id:
+            try:
+                diff = self.snapshot_store.diff(previous_id, snapshot_id)
+            except Exception as e:
+                self.log_message.emit(f"WARNING: Could not diff against snapshot {previous_id}: {e}")
+                return
+            if diff:
+                self.log_message.emit(f"INFO: Changes since snapshot {previous_id}:\n{diff.rstrip()}")
+            else:
+                self.log_message.emit(f"INFO: Configuration unchanged since snapshot {previous_id}")
+
+    def restore_latest_snapshot(self):
+        """Restore the most recent configuration snapshot and then check status."""
+        try:
+            snapshot_id = self.snapshot_store.latest_snapshot()
+        except Exception as e:
+            self.log_message.emit(f"ERROR: Could not read configuration snapshots: {e}")
+            return
+        if snapshot_id is None:
+            self.log_message.emit("WARNING: No configuration snapshot available to restore")
+            return
+        self.log_message.emit(f"INFO: Restoring Pass Wall configuration from snapshot {snapshot_id}...")
+        result = self.manager.restore_snapshot(self.snapshot_store, snapshot_id)
+        if result == "error":
+            self.log_message.emit(f"ERROR: Failed to restore configuration snapshot {snapshot_id}")
+        else:
+            self.log_message.emit(f"SUCCESS: Router configuration matches snapshot {snapshot_id}")
+        self.check_status()
+
     def run(self):
         """Main thread loop: poll status at configured interval."""
         self.log_message.emit(f"INFO: Background status monitoring started - polling interval: {self.poll_interval} seconds")
@@ -252,12 +340,14 @@ class StatusWorker(QThread):
                 self.check_ip()
                 self.ip_check_counter = 0
             
-            # Use shorter sleep intervals to be more responsive to stop signal
-            sleep_time = min(self.poll_interval, 1.0)  # Sleep for 1 second max
-            for _ in range(int(self.poll_interval / sleep_time)):
-                if not self.running:
+            # Sleep in slices of at most 1 second to be more responsive to stop signal
+            deadline = time.monotonic() + self.poll_interval
+            while self.running:
+                self._run_pending_requests()
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
                     break
-                self.sleep(sleep_time)
+                self.msleep(max(1, int(min(remaining, 1.0) * 1000)))
 
     def stop(self):
         """Stop the thread and wait for it to finish with timeout."""
@@ -281,29 +371,68 @@ class PasswallTrayApp(QApplication):
         self.current_status = "unknown"
         self.current_ip = "Unknown"
         self.last_notified_status = None
+        self.ui_update_count = 0
+        self.ui_update_time = 0.0
 
         # Load configuration
         self.config = Config()
         apply_stylesheet(self, theme=self.config.get('app.theme'))
 
-        # Initialize SSH manager (but don't connect yet)
-        self.manager = PassWallManager(
-            host=self.config.get('ssh.host'),
-            user=self.config.get('ssh.user'),
-            port=self.config.get('ssh.port'),
-            password=self.config.get('ssh.password'),
-            key_file=self.config.get('ssh.key_file')
-        )
-
-        # Setup UI and Worker
+        # Setup UI
         self.window = MainWindow()
-        self.worker = StatusWorker(self.manager)
+
+        # Initialize SSH manager (but don't connect yet), or replay a recorded session
+        self.trace_mode = self.config.get('trace.mode')
+        self.trace_speed = self.config.get('trace.speed') or 1.0
+        self.trace_recorder = None
+        self.manager = None
+        if self.trace_mode == "replay":
+            try:
+                self.manager = ReplayManager(self.config.get('trace.file'), speed=self.trace_speed)
+            except Exception as e:
+                self.window.log(f"ERROR: Cannot replay session trace, connecting to the router instead: {e}")
+                self.trace_mode = None
+        if self.manager is None:
+            self.manager = PassWallManager(
+                host=self.config.get('ssh.host'),
+                user=self.config.get('ssh.user'),
+                port=self.config.get('ssh.port'),
+                password=self.config.get('ssh.password'),
+                key_file=self.config.get('ssh.key_file')
+            )
+        if self.trace_mode == "record":
+            try:
+                self.trace_recorder = TraceRecorder(self.config.get('trace.file'), host=self.manager.host)
+                self.trace_recorder.attach(self.manager)
+            except Exception as e:
+                self.window.log(f"ERROR: Cannot record session trace, continuing without recording: {e}")
+                self.trace_recorder = None
+                self.trace_mode = None
+
+        # Setup Worker
+        self.snapshot_store = SnapshotStore(self.config.get('snapshot.directory') or "snapshots")
+        self.worker = StatusWorker(self.manager, snapshot_store=self.snapshot_store)
         poll_interval = self.config.get('app.poll_interval')
         self.worker.poll_interval = poll_interval if poll_interval is not None else 5
+        if self.trace_mode == "replay":
+            self.worker.poll_interval /= self.trace_speed
+        self.worker.snapshot_files = self.config.get('snapshot.files') or DEFAULT_SNAPSHOT_FILES
+
+        # Automatic toggling rules (optional)
+        self.rules_engine = None
+        self.rules_timer = QTimer(self)
+        self.rules_timer.setSingleShot(True)
+        self.rules_timer.timeout.connect(self._on_rules_timer)
+        if self.config.get('rules.enabled'):
+            try:
+                self.rules_engine = RulesEngine.from_config(self.config.get('rules'))
+            except Exception as e:
+                self.window.log(f"ERROR: Invalid automatic toggle rules in config.json: {e}")
 
         # Connect signals and slots
         self.worker.status_updated.connect(self.update_status)
         self.worker.ip_updated.connect(self.update_ip)
+        self.worker.latency_updated.connect(self.update_latency)
         self.worker.log_message.connect(self.window.log)
         self.window.refresh_requested.connect(self.worker.check_status)
         self.window.refresh_ip_requested.connect(self.worker.check_ip)
@@ -324,10 +453,17 @@ class PasswallTrayApp(QApplication):
 
         # Start background worker and show window
         self.worker.start()
+        if self.rules_engine:
+            self.window.log(f"INFO: Automatic toggling enabled with {len(self.rules_engine.rules)} rule(s).")
+            self._apply_rule_action(self.rules_engine.tick())
         self.window.show()
 
         # Log startup completion
         self.window.log("Application startup completed successfully.")
+        if self.trace_mode == "replay":
+            self.window.log(f"INFO: Replaying recorded session from {self.config.get('trace.file')} at {self.trace_speed}x speed - no network access.")
+        elif self.trace_mode == "record":
+            self.window.log(f"INFO: Recording SSH/HTTP session to {self.config.get('trace.file')}.")
         if QSystemTrayIcon.isSystemTrayAvailable():
             self.window.log("System tray is available.")
         else:
@@ -345,6 +481,10 @@ class PasswallTrayApp(QApplication):
         self.toggle_action.triggered.connect(self.handle_toggle_request)
         self.refresh_ip_action = QAction("Refresh IP")
         self.refresh_ip_action.triggered.connect(self.handle_refresh_ip_request)
+        self.snapshot_action = QAction("Snapshot Config")
+        self.snapshot_action.triggered.connect(self.worker.request_snapshot)
+        self.restore_action = QAction("Restore Last Snapshot")
+        self.restore_action.triggered.connect(self.worker.request_restore)
         self.show_action = QAction("Show Window")
         self.show_action.triggered.connect(self.window.show)
         self.quit_action = QAction("Quit")
@@ -355,6 +495,14 @@ class PasswallTrayApp(QApplication):
         self.menu.addSeparator()
         self.menu.addAction(self.toggle_action)
         self.menu.addAction(self.refresh_ip_action)
+        self.menu.addSeparator()
+        self.menu.addAction(self.snapshot_action)
+        self.menu.addAction(self.restore_action)
+        if self.trace_mode is not None:
+            # Snapshot file transfers bypass _execute_command and are not part of session traces
+            self.snapshot_action.setEnabled(False)
+            self.restore_action.setEnabled(False)
+        self.menu.addSeparator()
         self.menu.addAction(self.show_action)
         self.menu.addSeparator()
         self.menu.addAction(self.quit_action)
@@ -377,6 +525,30 @@ class PasswallTrayApp(QApplication):
         """Pass the toggle request to the worker thread with the current status."""
         self.worker.request_toggle(self.current_status)
 
+    def _apply_rule_action(self, action):
+        """Toggle Pass Wall through the worker if the rules engine asked for it, then reschedule the rules timer."""
+        if action:
+            rule_name = self.rules_engine.requested_decision[0]
+            self.window.log(f"AUTO: Rule '{rule_name}' requests Pass Wall to {action.upper()} (current state: {self.current_status.upper()})")
+            self.worker.request_toggle(self.current_status)
+        wakeup = self.rules_engine.next_wakeup()
+        if wakeup is None:
+            self.rules_timer.stop()
+        else:
+            delay_ms = int((wakeup - datetime.now()).total_seconds() * 1000) + 1000
+            self.rules_timer.start(max(1000, delay_ms))
+
+    def _feed_rules(self, key, value):
+        """Pass a new state value to the rules engine, if enabled."""
+        if self.rules_engine:
+            self._apply_rule_action(self.rules_engine.update(key, value))
+
+    @Slot()
+    def _on_rules_timer(self):
+        """Re-evaluate time-based rules when a time window opens or closes."""
+        if self.rules_engine:
+            self._apply_rule_action(self.rules_engine.tick())
+
     @Slot()
     def handle_refresh_ip_request(self):
         """Pass the refresh IP request to the worker thread."""
@@ -385,6 +557,7 @@ class PasswallTrayApp(QApplication):
     @Slot(str)
     def update_status(self, status):
         """Update state and all UI elements with the new status."""
+        started = time.monotonic()
         self.current_status = status
         self.window.update_status_ui(status)
         self.status_action.setText(f"Status: {status.capitalize()}")
@@ -424,9 +597,18 @@ class PasswallTrayApp(QApplication):
             else:
                 self.toggle_action.setText("Toggle Passwall")
 
+        self._add_ui_update_time(started)
+        self._feed_rules("status", status)
+
+    @Slot(float)
+    def update_latency(self, latency_ms):
+        """Pass the latest status check latency to the rules engine."""
+        self._feed_rules("latency_ms", latency_ms)
+
     @Slot(str)
     def update_ip(self, ip):
         """Update state and all UI elements with the new IP address."""
+        started = time.monotonic()
         self.current_ip = ip
         self.window.update_ip_ui(ip)
         self.ip_action.setText(f"IP: {ip}")
@@ -438,6 +620,13 @@ class PasswallTrayApp(QApplication):
                 QSystemTrayIcon.Information
             )
 
+        self._add_ui_update_time(started)
+        self._feed_rules("ip", ip)
+
+    def _add_ui_update_time(self, started):
+        self.ui_update_count += 1
+        self.ui_update_time += time.monotonic() - started
+
     def run(self):
         """Start the Qt event loop."""
         sys.exit(self.exec())
@@ -467,6 +656,19 @@ class PasswallTrayApp(QApplication):
             self.manager.close()
         except Exception as e:
             self.window.log(f"WARNING: Error closing SSH connection: {e}")
+
+        if self.trace_recorder:
+            self.trace_recorder.close()
+            self.window.log(f"INFO: Recorded {self.trace_recorder.event_count} event(s) to {self.trace_recorder.trace_file}")
+        elif self.trace_mode == "replay":
+            self.window.log(f"INFO: Replay summary: {self.manager.summary()}")
+            worker_ms = self.worker.check_overhead * 1000
+            ui_ms = self.ui_update_time * 1000
+            self.window.log(
+                f"INFO: Overhead excluding replayed network time - worker: {worker_ms:.1f} ms over "
+                f"{self.worker.check_count} check(s) ({worker_ms / max(1, self.worker.check_count):.2f} ms each), "
+                f"UI: {ui_ms:.1f} ms over {self.ui_update_count} update(s) ({ui_ms / max(1, self.ui_update_count):.2f} ms each)"
+            )
         
         # Quit immediately
         self.quit()
@@ -18,6 +18,20 @@ class Config:
                 "poll_interval": 3,
                 "theme": "dark_teal.xml",
                 "start_on_startup": False
+            },
+            "snapshot": {
+                "directory": "snapshots"
+            },
+            "rules": {
+                "enabled": False,
+                "min_toggle_interval": 300,
+                "audit_file": "rules_audit.log",
+                "rules": []
+            },
+            "trace": {
+                "mode": None,
+                "file": "session_trace.jsonl.gz",
+                "speed": 1.0
             }
         }
         self.config = self.load_config()
@@ -0,0 +1,256 @@
+import json
+import ipaddress
+from datetime import datetime, timedelta
+
+DAY_NAMES = ["mon", "tue", "wed", "thu", "fri", "sat", "sun"]
+
+
+class TimeWindow:
+    """Daily time window such as 09:00-18:00 on weekdays. Windows with end before start wrap past midnight."""
+    keys = set()
+
+    def __init__(self, start, end, days=None):
+        self.start = datetime.strptime(start, "%H:%M").time()
+        self.end = datetime.strptime(end, "%H:%M").time()
+        self.days = {DAY_NAMES.index(day.lower()[:3]) for day in days} if days else set(range(7))
+
+    def _windows_around(self, now):
+        """Yield (start, end) datetimes of the windows that could contain or follow now."""
+        for offset in range(-1, 8):
+            day = (now + timedelta(days=offset)).date()
+            if day.weekday() not in self.days:
+                continue
+            start = datetime.combine(day, self.start)
+            end = datetime.combine(day, self.end)
+            if end <= start:
+                end += timedelta(days=1)
+            yield start, end
+
+    def evaluate(self, state, now):
+        return any(start <= now < end for start, end in self._windows_around(now))
+
+    def next_transition(self, now):
+        """Return the next datetime at which this window opens or closes."""
+        boundaries = [t for window in self._windows_around(now) for t in window if t > now]
+        return min(boundaries) if boundaries else None
+
+
+class IpCondition:
+    """Matches when the current IP is (or is not) inside one of the given networks."""
+    keys = {"ip"}
+
+    def __init__(self, networks, negate=False):
+        self.networks = [ipaddress.ip_network(network, strict=False) for network in networks]
+        self.negate = negate
+
+    def evaluate(self, state, now):
+        ip = state.get("ip")
+        if not ip or ip == "error":
+            return False
+        try:
+            # get_current_ip reports the fallback address as "x.x.x.x (local)"
+            address = ipaddress.ip_address(ip.split()[0])
+        except ValueError:
+            return False
+        matched = any(address in network for network in self.networks)
+        return matched != self.negate
+
+
+class ReachableCondition:
+    """Matches when the router answered the last status check over SSH."""
+    keys = {"status"}
+
+    def evaluate(self, state, now):
+        return state.get("status") in ("active", "inactive")
+
+
+class LatencyCondition:
+    """Matches when the last status check latency is within the given bounds (milliseconds)."""
+    keys = {"latency_ms"}
+
+    def __init__(self, min_ms=None, max_ms=None):
+        self.min_ms = min_ms
+        self.max_ms = max_ms
+
+    def evaluate(self, state, now):
+        latency = state.get("latency_ms")
+        if latency is None:
+            return False
+        if self.min_ms is not None and latency < self.min_ms:
+            return False
+        if self.max_ms is not None and latency > self.max_ms:
+            return False
+        return True
+
+
+class Rule:
+    """A named set of conditions that must all hold for Pass Wall to be switched to action ('enable' or 'disable')."""
+
+    def __init__(self, name, action, conditions):
+        if action not in ("enable", "disable"):
+            raise ValueError(f"Rule '{name}': action must be 'enable' or 'disable', got '{action}'")
+        self.name = name
+        self.action = action
+        self.conditions = conditions
+        self.keys = set().union(*(condition.keys for condition in conditions)) if conditions else set()
+        self.time_windows = [condition for condition in conditions if isinstance(condition, TimeWindow)]
+
+    @classmethod
+    def from_dict(cls, data):
+        """Build a rule from its config.json representation."""
+        conditions = []
+        if "time" in data:
+            window = data["time"]
+            conditions.append(TimeWindow(window["start"], window["end"], window.get("days")))
+        if "ip_in" in data:
+            conditions.append(IpCondition(data["ip_in"]))
+        if "ip_not_in" in data:
+            conditions.append(IpCondition(data["ip_not_in"], negate=True))
+        if "reachable" in data:
+            # An unreachable router cannot be toggled, so only 'true' is meaningful
+            if data["reachable"] is not True:
+                raise ValueError(f"Rule '{data.get('name', data['action'])}': 'reachable' only supports true")
+            conditions.append(ReachableCondition())
+        if "min_latency_ms" in data or "max_latency_ms" in data:
+            conditions.append(LatencyCondition(data.get("min_latency_ms"), data.get("max_latency_ms")))
+        return cls(data.get("name", data["action"]), data["action"], conditions)
+
+    def evaluate(self, state, now):
+        return all(condition.evaluate(state, now) for condition in self.conditions)
+
+
+class RulesEngine:
+    """
+    Decides when Pass Wall should be switched automatically.
+    State is pushed in with update(); only rules depending on the changed key are
+    re-evaluated, and time windows are re-evaluated by tick() at their boundaries
+    (see next_wakeup()). The first matching rule wins. A toggle is requested only
+    when the winning decision changes, so manual toggles are not fought, and
+    automatic toggles are spaced at least min_toggle_interval seconds apart.
+    A decision only counts as applied once a status update confirms it; a toggle
+    that did not take effect is audited as failed and retried after the interval.
+    """
+
+    def __init__(self, rules, min_toggle_interval=300, audit_file=None):
+        self.rules = rules
+        self.min_toggle_interval = min_toggle_interval
+        self.audit_file = audit_file
+        self.state = {}
+        self.results = {}
+        self.applied_decision = None
+        self.requested_decision = None
+        self.last_toggle_time = None
+        self.toggle_pending = False
+
+    @classmethod
+    def from_config(cls, config):
+        """Build an engine from the 'rules' section of config.json."""
+        rules = [Rule.from_dict(rule) for rule in config.get("rules") or []]
+        return cls(
+            rules,
+            min_toggle_interval=config.get("min_toggle_interval", 300),
+            audit_file=config.get("audit_file")
+        )
+
+    def _audit(self, now, event, rule=None, action=None, detail=None):
+        if not self.audit_file:
+            return
+        entry = {
+            "time": now.strftime("%Y-%m-%d %H:%M:%S"),
+            "event": event,
+            "rule": rule.name if rule else None,
+            "action": action,
+            "status": self.state.get("status"),
+            "ip": self.state.get("ip"),
+            "latency_ms": self.state.get("latency_ms"),
+            "detail": detail
+        }
+        try:
+            with open(self.audit_file, 'a') as f:
+                f.write(json.dumps(entry) + "\n")
+        except Exception as e:
+            print(f"Error writing rules audit log: {e}")
+
+    def _winning_rule(self):
+        for rule in self.rules:
+            if self.results.get(rule):
+                return rule
+        return None
+
+    def update(self, key, value, now=None):
+        """Record a new state value. Returns the action to perform ('enable'/'disable') or None."""
+        now = now or datetime.now()
+        if key == "ip" and value == "error":
+            # A failed IP lookup says nothing about where traffic exits; keep the previous results
+            return None
+        if key in self.state and self.state[key] == value:
+            return self._decide(now, status_reported=(key == "status"))
+        self.state[key] = value
+        for rule in self.rules:
+            if key in rule.keys:
+                self.results[rule] = rule.evaluate(self.state, now)
+        return self._decide(now, status_reported=(key == "status"))
+
+    def tick(self, now=None):
+        """Re-evaluate time-dependent rules. Returns the action to perform or None."""
+        now = now or datetime.now()
+        for rule in self.rules:
+            if rule.time_windows or rule not in self.results:
+                self.results[rule] = rule.evaluate(self.state, now)
+        return self._decide(now)
+
+    def next_wakeup(self, now=None):
+        """Return the next datetime tick() should be called at, or None if nothing is time-dependent."""
+        now = now or datetime.now()
+        candidates = [
+            window.next_transition(now)
+            for rule in self.rules for window in rule.time_windows
+        ]
+        if self.toggle_pending and self.last_toggle_time:
+            candidates.append(self.last_toggle_time + timedelta(seconds=self.min_toggle_interval))
+        candidates = [candidate for candidate in candidates if candidate is not None]
+        return min(candidates) if candidates else None
+
+    def _decide(self, now, status_reported=False):
+        rule = self._winning_rule()
+        decision = (rule.name, rule.action) if rule else None
+        status = self.state.get("status")
+        toggled = False
+        if self.requested_decision is not None:
+            if not status_reported:
+                # Wait for the status check that follows the requested toggle
+                return None
+            toggled = self.requested_decision == decision
+            if toggled and (status == "active") != (rule.action == "enable"):
+                self._audit(now, "toggle_failed", rule, rule.action, f"Pass Wall is still {status} after toggle")
+            self.requested_decision = None
+
+        if decision == self.applied_decision:
+            self.toggle_pending = False
+            return None
+        if rule is None:
+            self.applied_decision = None
+            self.toggle_pending = False
+            return None
+
+        if status not in ("active", "inactive"):
+            # Wait until the real service state is known before acting
+            return None
+        if (status == "active") == (rule.action == "enable"):
+            self.applied_decision = decision
+            self.toggle_pending = False
+            self._audit(now, "satisfied", rule, rule.action,
+                        "Automatic toggle took effect" if toggled else "Pass Wall already in requested state")
+            return None
+        if self.last_toggle_time and (now - self.last_toggle_time).total_seconds() < self.min_toggle_interval:
+            if not self.toggle_pending:
+                self._audit(now, "rate_limited", rule, rule.action,
+                            f"Last automatic toggle at {self.last_toggle_time.strftime('%H:%M:%S')}")
+            self.toggle_pending = True
+            return None
+
+        self.requested_decision = decision
+        self.last_toggle_time = now
+        self.toggle_pending = False
+        self._audit(now, "toggle_requested", rule, rule.action)
+        return rule.action
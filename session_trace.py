@@ -0,0 +1,221 @@
+import gzip
+import json
+import time
+import threading
+from collections import deque
+from datetime import datetime
+from ssh_manager import PassWallManager
+
+TRACE_FORMAT = "passwall-trace"
+TRACE_VERSION = 1
+
+# Event kinds and the PassWallManager methods they capture
+EVENT_CONNECT = "connect"
+EVENT_EXEC = "exec"
+EVENT_IP = "ip"
+
+
+class TraceRecorder:
+    """
+    Records the network-facing calls of a PassWallManager (_connect, _execute_command
+    and get_current_ip) with their results and timings into a gzip-compressed
+    JSON-lines trace file that ReplayManager can play back without a network.
+    Connection attempts made inside _execute_command are stored on the exec event
+    ("c") rather than as separate events, since the exec duration already includes them.
+    """
+    def __init__(self, trace_file, host=None):
+        """Open trace_file for writing and write the trace header."""
+        self.trace_file = trace_file
+        self.lock = threading.Lock()
+        self.event_count = 0
+        self._local = threading.local()
+        self._file = gzip.open(trace_file, 'wt', encoding='utf-8')
+        self._write({
+            "format": TRACE_FORMAT,
+            "version": TRACE_VERSION,
+            "host": host,
+            "created": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        })
+
+    def _write(self, entry):
+        with self.lock:
+            if self._file is None:
+                return
+            self._file.write(json.dumps(entry, separators=(',', ':')) + "\n")
+            # Sync-flush so the trace stays readable if the app is killed
+            self._file.flush()
+
+    def record(self, kind, arg, started, result=None, error=None, connects=None):
+        """Append one event. started is the time.monotonic() value at which the call began."""
+        entry = {
+            "k": kind,
+            "a": arg,
+            "d": round(time.monotonic() - started, 4)
+        }
+        if error is not None:
+            entry["e"] = error
+        else:
+            entry["r"] = result
+        if connects:
+            entry["c"] = connects
+        self._write(entry)
+        self.event_count += 1
+
+    def _wrap(self, kind, method, arg_of):
+        def wrapper(*args, **kwargs):
+            nested = getattr(self._local, "connects", None)
+            if kind == EVENT_CONNECT and nested is not None:
+                # Part of an _execute_command call: fold into that exec event
+                result = method(*args, **kwargs)
+                nested.append(result)
+                return result
+            if kind == EVENT_EXEC:
+                self._local.connects = []
+            started = time.monotonic()
+            try:
+                result = method(*args, **kwargs)
+            except Exception as e:
+                self.record(kind, arg_of(args, kwargs), started, error=str(e), connects=self._end_exec(kind))
+                raise
+            self.record(kind, arg_of(args, kwargs), started, connects=self._end_exec(kind),
+                        result=list(result) if isinstance(result, tuple) else result)
+            return result
+        return wrapper
+
+    def _end_exec(self, kind):
+        if kind != EVENT_EXEC:
+            return None
+        connects = self._local.connects
+        self._local.connects = None
+        return connects
+
+    def attach(self, manager):
+        """Start recording calls made on manager (including its own internal calls)."""
+        manager._connect = self._wrap(EVENT_CONNECT, manager._connect, lambda args, kwargs: None)
+        manager._execute_command = self._wrap(
+            EVENT_EXEC, manager._execute_command,
+            lambda args, kwargs: args[0] if args else kwargs.get('command')
+        )
+        manager.get_current_ip = self._wrap(EVENT_IP, manager.get_current_ip, lambda args, kwargs: None)
+        return manager
+
+    def close(self):
+        """Finish the trace file."""
+        with self.lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+def load_trace(trace_file):
+    """Read a trace file. Returns (header, events). A truncated trace yields the events read so far."""
+    lines = []
+    with gzip.open(trace_file, 'rt', encoding='utf-8') as f:
+        try:
+            for line in f:
+                lines.append(line)
+        except EOFError:
+            pass
+    entries = []
+    for line in lines:
+        try:
+            entries.append(json.loads(line))
+        except ValueError:
+            break
+    if not entries or entries[0].get("format") != TRACE_FORMAT:
+        raise ValueError(f"{trace_file} is not a Pass Wall session trace")
+    if entries[0].get("version") != TRACE_VERSION:
+        raise ValueError(f"Unsupported trace version {entries[0].get('version')} in {trace_file}")
+    return entries[0], entries[1:]
+
+
+class ReplayManager(PassWallManager):
+    """
+    PassWallManager that answers _connect, _execute_command and get_current_ip from a
+    recorded trace instead of the network. Recorded call durations are reproduced,
+    divided by speed (e.g. speed=10 replays ten times faster). Calls are matched to
+    recorded events by kind and command, in recorded order, so get_status and
+    toggle_service parse exactly the output the router produced. Time spent in
+    those simulated delays is tracked per thread (thread_sleep_time()) so callers
+    can subtract it and measure their own overhead.
+    """
+    def __init__(self, trace_file, speed=1.0, loop=False):
+        """Load trace_file. If loop is True, events are reused once exhausted."""
+        if speed <= 0:
+            raise ValueError("Replay speed must be greater than 0")
+        header, events = load_trace(trace_file)
+        super().__init__(host=header.get("host") or "replay", user="replay")
+        self.trace_file = trace_file
+        self.speed = speed
+        self.loop = loop
+        self.events = events
+        self.lock = threading.Lock()
+        self.queues = {}
+        for event in events:
+            self.queues.setdefault((event["k"], event["a"]), deque()).append(event)
+        self.replayed_count = 0
+        self.missed_count = 0
+        self.network_time = 0.0
+        self.sleep_time = 0.0
+        self._local = threading.local()
+
+    def _next_event(self, kind, arg, log_message=None):
+        with self.lock:
+            queue = self.queues.get((kind, arg))
+            if not queue and self.loop:
+                queue = deque(event for event in self.events if event["k"] == kind and event["a"] == arg)
+                self.queues[(kind, arg)] = queue
+            if not queue:
+                self.missed_count += 1
+                self._log(f"WARNING: No recorded {kind} event left for {arg!r} in trace.", log_message)
+                return None
+            event = queue.popleft()
+            self.replayed_count += 1
+            self.network_time += event["d"]
+        started = time.monotonic()
+        time.sleep(event["d"] / self.speed)
+        slept = time.monotonic() - started
+        self._local.sleep_time = self.thread_sleep_time() + slept
+        with self.lock:
+            self.sleep_time += slept
+        if "e" in event:
+            raise RuntimeError(event["e"])
+        return event
+
+    def _connect(self, log_message=None):
+        """Replay a recorded connection attempt."""
+        event = self._next_event(EVENT_CONNECT, None, log_message)
+        return bool(event and event["r"])
+
+    def _execute_command(self, command, log_message=None):
+        """Replay the recorded (stdout, stderr) for command."""
+        event = self._next_event(EVENT_EXEC, command, log_message)
+        if event is None:
+            return None, "Trace exhausted"
+        self._log(f"INFO: Replaying remote command: {command}", log_message)
+        out, err = event["r"]
+        return out, err
+
+    def get_current_ip(self, log_message=None):
+        """Replay the recorded IP lookup result."""
+        event = self._next_event(EVENT_IP, None, log_message)
+        if event is None:
+            return "error"
+        return event["r"]
+
+    def close(self, log_message=None):
+        self._log("INFO: Replay session closed.", log_message)
+
+    def thread_sleep_time(self):
+        """Return the seconds the calling thread has spent in simulated network delays."""
+        return getattr(self._local, "sleep_time", 0.0)
+
+    def summary(self):
+        """Return replay statistics: events used, recorded network time and time actually slept for it."""
+        return {
+            "replayed": self.replayed_count,
+            "missed": self.missed_count,
+            "remaining": sum(len(queue) for queue in self.queues.values()),
+            "network_time": round(self.network_time, 3),
+            "sleep_time": round(self.sleep_time, 3)
+        }
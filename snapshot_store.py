@@ -0,0 +1,112 @@
+import os
+import json
+import zlib
+import hashlib
+import difflib
+from datetime import datetime
+
+class SnapshotStore:
+    """
+    Local store for Pass Wall configuration snapshots.
+    File contents are kept once per checksum (content-addressed) and compressed;
+    each snapshot is a small manifest mapping remote paths to checksums.
+    """
+    def __init__(self, directory="snapshots"):
+        """Initialize the store rooted at directory, creating it if needed."""
+        self.directory = directory
+        self.objects_dir = os.path.join(directory, "objects")
+        self.manifests_dir = os.path.join(directory, "manifests")
+        os.makedirs(self.objects_dir, exist_ok=True)
+        os.makedirs(self.manifests_dir, exist_ok=True)
+
+    @staticmethod
+    def checksum(data):
+        """Return the SHA-256 hex digest of data (bytes)."""
+        return hashlib.sha256(data).hexdigest()
+
+    def _blob_path(self, digest):
+        return os.path.join(self.objects_dir, digest[:2], digest[2:])
+
+    def _manifest_path(self, snapshot_id):
+        return os.path.join(self.manifests_dir, f"{snapshot_id}.json")
+
+    def put_blob(self, data):
+        """Store data if not already present. Returns its checksum."""
+        digest = self.checksum(data)
+        path = self._blob_path(digest)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = path + ".tmp"
+            with open(tmp_path, 'wb') as f:
+                f.write(zlib.compress(data, 9))
+            os.replace(tmp_path, path)
+        return digest
+
+    def get_blob(self, digest):
+        """Return the stored bytes for digest. Raises ValueError if the object is corrupt."""
+        with open(self._blob_path(digest), 'rb') as f:
+            data = zlib.decompress(f.read())
+        if self.checksum(data) != digest:
+            raise ValueError(f"Snapshot object {digest} is corrupt")
+        return data
+
+    def save_snapshot(self, files, host=None, note=None):
+        """Store a snapshot of files (dict of remote path -> bytes). Returns the snapshot id."""
+        created = datetime.now()
+        base_id = created.strftime("%Y%m%d-%H%M%S")
+        snapshot_id = base_id
+        counter = 1
+        while os.path.exists(self._manifest_path(snapshot_id)):
+            snapshot_id = f"{base_id}-{counter}"
+            counter += 1
+        manifest = {
+            "id": snapshot_id,
+            "created": created.strftime("%Y-%m-%d %H:%M:%S"),
+            "host": host,
+            "note": note,
+            "files": {path: self.put_blob(data) for path, data in sorted(files.items())}
+        }
+        with open(self._manifest_path(snapshot_id), 'w') as f:
+            json.dump(manifest, f, indent=4)
+        return snapshot_id
+
+    def load_snapshot(self, snapshot_id):
+        """Return the manifest dict for snapshot_id."""
+        with open(self._manifest_path(snapshot_id), 'r') as f:
+            return json.load(f)
+
+    def list_snapshots(self):
+        """Return all snapshot ids, oldest first."""
+        ids = [name[:-len(".json")] for name in os.listdir(self.manifests_dir) if name.endswith(".json")]
+        return sorted(ids, key=lambda snapshot_id: self.load_snapshot(snapshot_id)["created"] + snapshot_id)
+
+    def latest_snapshot(self):
+        """Return the id of the most recent snapshot, or None if the store is empty."""
+        ids = self.list_snapshots()
+        return ids[-1] if ids else None
+
+    def get_files(self, snapshot_id):
+        """Return a dict of remote path -> bytes for snapshot_id."""
+        manifest = self.load_snapshot(snapshot_id)
+        return {path: self.get_blob(digest) for path, digest in manifest["files"].items()}
+
+    def diff(self, old_id, new_id):
+        """Return a unified diff between two snapshots as a string (empty if identical)."""
+        old_files = self.load_snapshot(old_id)["files"]
+        new_files = self.load_snapshot(new_id)["files"]
+        chunks = []
+        for path in sorted(set(old_files) | set(new_files)):
+            old_digest = old_files.get(path)
+            new_digest = new_files.get(path)
+            if old_digest == new_digest:
+                continue
+            old_lines = self.get_blob(old_digest).decode('utf-8', errors='replace').splitlines(keepends=True) if old_digest else []
+            new_lines = self.get_blob(new_digest).decode('utf-8', errors='replace').splitlines(keepends=True) if new_digest else []
+            chunks.extend(difflib.unified_diff(
+                old_lines, new_lines,
+                fromfile=f"{old_id}:{path}" if old_digest else "/dev/null",
+                tofile=f"{new_id}:{path}" if new_digest else "/dev/null"
+            ))
+            if chunks and not chunks[-1].endswith("\n"):
+                chunks[-1] += "\n"
+        return "".join(chunks)
@@ -1,10 +1,18 @@
 
 import paramiko
 import os
+import time
+import shlex
 import socket
 import requests
 from datetime import datetime
 
+# Remote files captured by config snapshots unless a list is passed explicitly.
+DEFAULT_SNAPSHOT_FILES = [
+    "/etc/config/passwall",
+    "/etc/config/passwall_server"
+]
+
 class PassWallManager:
     """
     Handles SSH communication with the OpenWrt gateway to manage Pass Wall service.
@@ -56,11 +64,16 @@ class PassWallManager:
             self._log(f"ERROR: Failed to connect: {e}", log_message)
             return False
 
+    def _ensure_connected(self, log_message=None):
+        """Connect if there is no active transport. Returns True if connected."""
+        if not self.client.get_transport() or not self.client.get_transport().is_active():
+            return self._connect(log_message=log_message)
+        return True
+
     def _execute_command(self, command, log_message=None):
         """Execute a command over SSH. Returns (stdout, stderr)."""
-        if not self.client.get_transport() or not self.client.get_transport().is_active():
-            if not self._connect(log_message=log_message):
-                return None, "Connection failed"
+        if not self._ensure_connected(log_message=log_message):
+            return None, "Connection failed"
         try:
             self._log(f"INFO: Executing remote command: {command}", log_message)
             stdin, stdout, stderr = self.client.exec_command(command, timeout=10)  # Add timeout to command execution
@@ -94,6 +107,157 @@ class PassWallManager:
             return "error"
         return "ok"
 
+    def _open_sftp(self, log_message=None):
+        """Open an SFTP session. Returns None if the router has no SFTP server (falls back to cat)."""
+        try:
+            return self.client.open_sftp()
+        except Exception as e:
+            self._log(f"INFO: SFTP unavailable ({e}), falling back to streamed cat.", log_message)
+            return None
+
+    def _read_remote_file(self, path, sftp=None, log_message=None):
+        """Read a remote file. Returns bytes, or None if it does not exist or cannot be read."""
+        try:
+            if sftp:
+                with sftp.open(path, 'rb') as f:
+                    return f.read()
+            stdin, stdout, stderr = self.client.exec_command(f"cat {shlex.quote(path)}", timeout=10)
+            data = stdout.read()
+            if stdout.channel.recv_exit_status() != 0:
+                self._log(f"WARNING: Could not read {path}: {stderr.read().decode('utf-8').strip()}", log_message)
+                return None
+            return data
+        except IOError as e:
+            self._log(f"WARNING: Could not read {path}: {e}", log_message)
+            return None
+        except Exception as e:
+            self._log(f"ERROR: Exception while reading {path}: {e}", log_message)
+            return None
+
+    def _write_remote_file(self, path, data, sftp=None, log_message=None):
+        """Write bytes to a remote file via a temporary file and rename. Returns True on success."""
+        tmp_path = f"{path}.passwall_switch.tmp"
+        try:
+            if sftp:
+                with sftp.open(tmp_path, 'wb') as f:
+                    f.write(data)
+                command = f"mv -f {shlex.quote(tmp_path)} {shlex.quote(path)}"
+            else:
+                command = f"cat > {shlex.quote(tmp_path)} && mv -f {shlex.quote(tmp_path)} {shlex.quote(path)}"
+            stdin, stdout, stderr = self.client.exec_command(command, timeout=10)
+            if not sftp:
+                stdin.write(data)
+                stdin.channel.shutdown_write()
+            if stdout.channel.recv_exit_status() != 0:
+                self._log(f"ERROR: Could not write {path}: {stderr.read().decode('utf-8').strip()}", log_message)
+                return False
+            return True
+        except Exception as e:
+            self._log(f"ERROR: Exception while writing {path}: {e}", log_message)
+            return False
+
+    def get_remote_checksums(self, paths, log_message=None):
+        """Return a dict of path -> SHA-256 digest for the remote files that exist, or None on failure."""
+        command = "sha256sum " + " ".join(shlex.quote(path) for path in paths)
+        stdout, stderr = self._execute_command(command, log_message=log_message)
+        if stdout is None:
+            return None
+        checksums = {}
+        for line in stdout.splitlines():
+            parts = line.split(None, 1)
+            if len(parts) == 2:
+                checksums[parts[1].strip()] = parts[0]
+        return checksums
+
+    def snapshot_config(self, store, paths=None, note=None, log_message=None):
+        """Fetch the Pass Wall config files into store. Returns the snapshot id or 'error'."""
+        paths = paths or DEFAULT_SNAPSHOT_FILES
+        if not self._ensure_connected(log_message=log_message):
+            return "error"
+        sftp = self._open_sftp(log_message)
+        files = {}
+        try:
+            for path in paths:
+                data = self._read_remote_file(path, sftp=sftp, log_message=log_message)
+                if data is not None:
+                    files[path] = data
+        finally:
+            if sftp:
+                sftp.close()
+        if not files:
+            self._log("ERROR: None of the configuration files could be fetched from the router.", log_message)
+            return "error"
+        try:
+            snapshot_id = store.save_snapshot(files, host=self.host, note=note)
+        except Exception as e:
+            self._log(f"ERROR: Could not save configuration snapshot: {e}", log_message)
+            return "error"
+        self._log(f"SUCCESS: Saved configuration snapshot {snapshot_id} ({len(files)} file(s)).", log_message)
+        return snapshot_id
+
+    def restore_snapshot(self, store, snapshot_id, log_message=None):
+        """
+        Restore a snapshot to the router, uploading only files whose checksum differs,
+        then restart Pass Wall and verify the router converged. Returns 'ok' or 'error'.
+        """
+        try:
+            manifest = store.load_snapshot(snapshot_id)
+        except Exception as e:
+            self._log(f"ERROR: Could not load snapshot {snapshot_id}: {e}", log_message)
+            return "error"
+        expected = manifest["files"]
+        remote = self.get_remote_checksums(list(expected), log_message=log_message)
+        if remote is None:
+            return "error"
+        changed = [path for path, digest in expected.items() if remote.get(path) != digest]
+        if not changed:
+            self._log(f"INFO: Router already matches snapshot {snapshot_id}, nothing to restore.", log_message)
+            return "ok"
+
+        # Load and verify every object before touching the router so a corrupt store cannot half-restore it
+        blobs = {}
+        for path in changed:
+            try:
+                blobs[path] = store.get_blob(expected[path])
+            except Exception as e:
+                self._log(f"ERROR: Snapshot {snapshot_id} is unusable, {path} could not be loaded: {e}", log_message)
+                return "error"
+
+        sftp = self._open_sftp(log_message)
+        try:
+            for path in changed:
+                self._log(f"INFO: Restoring {path} from snapshot {snapshot_id}", log_message)
+                if not self._write_remote_file(path, blobs[path], sftp=sftp, log_message=log_message):
+                    return "error"
+        finally:
+            if sftp:
+                sftp.close()
+
+        # Restart only a running service; rc.common restart would also start a stopped one
+        status_before = self.get_status(log_message=log_message)
+        if status_before == "active":
+            stdout, stderr = self._execute_command("/etc/init.d/passwall restart", log_message=log_message)
+            if stdout is None:
+                return "error"
+        else:
+            self._log(f"INFO: Pass Wall is {status_before}, not restarting; the restored configuration applies on next start.", log_message)
+
+        remote = self.get_remote_checksums(list(expected), log_message=log_message)
+        if remote is None or any(remote.get(path) != digest for path, digest in expected.items()):
+            self._log(f"ERROR: Router configuration does not match snapshot {snapshot_id} after restore.", log_message)
+            return "error"
+        # Pass Wall must come back in the state it was in before the restart
+        expected_status = status_before if status_before in ("active", "inactive") else None
+        status = "error"
+        for _ in range(10):
+            status = self.get_status(log_message=log_message)
+            if status != "error" and (expected_status is None or status == expected_status):
+                self._log(f"SUCCESS: Restored {len(changed)} file(s) from snapshot {snapshot_id}; Pass Wall is {status}.", log_message)
+                return "ok"
+            time.sleep(1)
+        self._log(f"ERROR: Pass Wall did not converge after restore (expected {expected_status or 'a valid status'}, got {status}).", log_message)
+        return "error"
+
     def get_current_ip(self, log_message=None):
         """Get the current public IP address using external service. Returns IP string or 'error'."""
         try: